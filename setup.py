@@ -1,9 +1,11 @@
-from setuptools import setup, find_packages
+from setuptools import setup
 
 name = 'varbio'
 setup(
     version='3.0.3',
     name=name,
-    # Only include {name}/, not e.g. tests/
-    packages=find_packages(include=(name, name + '.*')),
+    # Only include {name}/, not e.g. tests/. Listed explicitly rather than
+    # with find_packages to avoid walking the source tree on each setup.py
+    # call; add any new subpackage here.
+    packages=[name],
 )
@@ -18,30 +18,33 @@
 
 from copy import copy
 from importlib import resources
+from pathlib import Path
+import csv
+import os
 import warnings
 
 from pytil.data_frame import assert_df_equals
 import numpy as np
 import pandas as pd
 import pytest
-import scipy.stats
 
 from varbio import (
     pearson, pearson_df, parse_yaml, ExpressionMatrix, UserError, parse_csv,
     parse_baits
 )
+from varbio._util import _CHARDET_SAMPLE_SIZE
+from varbio._various import _ordinal
 
 
-pearsonr = lambda x, y: scipy.stats.pearsonr(x, y)[0]
 np.random.seed(0)
 
 
 class TestParseCSV:
 
-    def _parse(self, name):
+    def _parse(self, name, **kwargs):
         ctx = resources.path('tests.data.parse_csv_is_robust', name)
         with ctx as path:
-            return list(parse_csv(path))
+            return list(parse_csv(path, **kwargs))
 
     @pytest.mark.parametrize('name', (
         # Autodetect encoding
@@ -79,6 +82,14 @@ class TestParseCSV:
             ['gene1', '12.2', '34.5'],
         ]
 
+    def test_given_dialect_and_encoding(self):
+        'Use the given dialect and encoding instead of detecting them'
+        assert self._parse('tab_separator.csv', dialect=csv.excel) == [
+            ['gene\tcol1\tcol2'],
+            ['gene1\t12.2\t34.5'],
+        ]
+        assert self._parse('utf8_bom.csv', encoding='utf-8')[0][0] == '\ufeffgene'
+
     def test_trim(self):
         'Trim row/header values, but preserve inner whitespace'
         assert self._parse('untrimmed_value.csv') == [
@@ -86,6 +97,25 @@ class TestParseCSV:
             ['gene 1', '12.2', '34.5'],
         ]
 
+    def test_encoding_past_sample(self, tmp_path):
+        'Detect encoding when other than ascii only beyond the chardet sample'
+        path = tmp_path / 'file.csv'
+        row = b'gene1,1.0,2.0\n'
+        rows = row * (_CHARDET_SAMPLE_SIZE // len(row) + 1)
+        path.write_bytes(
+            b'gene,col1,col2\n' + rows + 'géneéè,3.0,4.0\n'.encode('latin1')
+        )
+        assert list(parse_csv(path))[-1] == ['géneéè', '3.0', '4.0']
+
+    def test_multiline_value(self, tmp_path):
+        'Keep line endings in a quoted value spanning lines'
+        path = tmp_path / 'file.csv'
+        path.write_text('gene,col1,col2\n"ge\nne1",1.0,2.0\n')
+        assert list(parse_csv(path)) == [
+            ['gene', 'col1', 'col2'],
+            ['ge\nne1', '1.0', '2.0'],
+        ]
+
     @pytest.mark.parametrize('name,line_number,col,line', (
         ('empty_header_value.csv', 1, 1, ' 	,col1,col2'),
         ('empty_row_value.csv', 3, 2, 'gene1, 	,34.5'),
@@ -153,6 +183,29 @@ def test_parse_yaml_wraps_yaml_error():
     assert 'whitespace_tabs.yaml' in msg
     assert r'\t' in msg
 
+def test_parse_yaml_cache(tmp_path):
+    'Return a fresh copy on each call and reparse when the file changes'
+    path = tmp_path / 'file.yaml'
+    path.write_text('[1, 2]')
+    actual = parse_yaml(path)
+    actual.append(3)
+    assert parse_yaml(path) == [1, 2]
+
+    path.write_text('[1, 2, 3, 4]')
+    assert parse_yaml(path) == [1, 2, 3, 4]
+
+def test_parse_yaml_cache_relative_path(tmp_path, monkeypatch):
+    'Do not mix up equal relative paths from different working directories'
+    for name, content in (('a', '[1]'), ('b', '[2]')):
+        (tmp_path / name).mkdir()
+        path = tmp_path / name / 'file.yaml'
+        path.write_text(content)
+        os.utime(path, ns=(0, 0))  # same mtime and size as the other file
+    monkeypatch.chdir(tmp_path / 'a')
+    assert parse_yaml(Path('file.yaml')) == [1]
+    monkeypatch.chdir(tmp_path / 'b')
+    assert parse_yaml(Path('file.yaml')) == [2]
+
 class TestParseBaits:
 
     '''
@@ -208,7 +261,7 @@ class TestExpressionMatrixHappyDays:
 
     def test_from_csv(self):
         '''
-        relies on _from_array and already got validated a lot by parse_csv so
+        relies on _from_parts and already got validated a lot by parse_csv so
         we only need test its happy days case
         '''
         matrix = ExpressionMatrix.from_csv(
@@ -279,6 +332,26 @@ class TestExpressionMatrixFromDict:
         assert '2nd' in msg
         assert 'less columns' in msg
 
+    @pytest.mark.parametrize('value', ([1.2], []))
+    def test_raise_on_list_value(self, value):
+        'Raise user friendly error when a value is a list'
+        with pytest.raises(UserError) as ex:
+            ExpressionMatrix.from_dict({
+                'name': 'myname',
+                'data': [
+                    ['gene', 'col1'],
+                    ['row1', value],
+                ]
+            })
+        assert 'must not be lists' in str(ex.value)
+
+@pytest.mark.parametrize('number,expected', (
+    (1, '1st'), (2, '2nd'), (3, '3rd'), (4, '4th'), (11, '11th'),
+    (12, '12th'), (13, '13th'), (21, '21st'), (102, '102nd'), (111, '111th'),
+))
+def test_ordinal(number, expected):
+    assert _ordinal(number) == expected
+
 class TestExpressionMatrixFromArray:
 
     def test_keep_index_and_cols_as_str(self):
@@ -337,10 +410,11 @@ class TestExpressionMatrixFromArray:
         assert 'could not convert string to float' in msg
         assert value in msg
 
-def unvectorised_pearson(data, indices):
+def reference_pearson(data, indices):
     if not data.size or not len(indices):  # pylint: disable=len-as-condition
         return np.empty((data.shape[0], len(indices)))
-    return np.array([np.apply_along_axis(pearsonr, 1, data, data[item]) for item in indices]).T
+    # atleast_2d as corrcoef returns a scalar given a single row
+    return np.atleast_2d(np.corrcoef(data))[:, indices]
 
 @pytest.mark.parametrize('data', (
     # Data for which no pair of rows has the same correlation, taking into
@@ -356,31 +430,33 @@ def unvectorised_pearson(data, indices):
 ))
 class TestPearson:
 
-    'Test pearson against its automatically vectorised equivalent'
+    'Test pearson against numpy.corrcoef'
 
     def assert_pearson(self, data, indices):
         with warnings.catch_warnings():
-            # Suppress division by zero warnings. For performance, vectorised
-            # correlation functions needn't check for rows such as
-            # (1, 1, 1), which cause division by zero in pearson.
+            # Suppress division by zero warnings of numpy.corrcoef on rows
+            # such as (1, 1, 1). pearson itself does not divide by zero.
             warnings.filterwarnings(
                 'ignore',
-                'invalid value encountered in double_scalars',
+                'invalid value encountered in divide',
                 RuntimeWarning
             )
 
-            # Calculate actual
-            data_original = data.copy()
+            # Calculate actual. Read-only data asserts pearson does not
+            # modify it, without having to copy and compare it
             indices_original = copy(indices)
-            actual = pearson(data, indices)
-            np.testing.assert_array_equal(data, data_original)
+            data.flags.writeable = False
+            try:
+                actual = pearson(data, indices)
+            finally:
+                data.flags.writeable = True
             assert indices == indices_original
 
             # Calculate expected
             #
             # Note: we should actually take twice the default error in allclose as
             # we compare to another algorithm which also has numerical errors
-            expected = unvectorised_pearson(data, indices)
+            expected = reference_pearson(data, indices)
 
             # Assert actual == expected
             np.testing.assert_allclose(actual, expected, equal_nan=True)
@@ -410,6 +486,10 @@ class TestPearson:
         indices = [1, 2, 1]
         self.assert_pearson(data, indices)
 
+    def test_subset_mask(self, data):
+        'When subset is given as a boolean mask'
+        self.assert_pearson(data, [i % 2 == 1 for i in range(len(data))])
+
     def test_data_1_row(self, data):
         'When data is 1 row'
         self.assert_pearson(data[[0]], [0])
@@ -439,7 +519,7 @@ class TestPearsonDf:
     def mock_pearson(self, monkeypatch):
         # We only need to test the df wrapper part, not the vectorised pearson
         # calculation itself, so replace it with something simple
-        def vectorised(data, indices):
+        def vectorised(data, indices, dtype):  # pylint: disable=unused-argument
             if not data.size or len(indices) == 0:
                 return np.empty((0, 0))
             return np.dot(data, data[indices].T + 1)
@@ -467,6 +547,13 @@ class TestPearsonDf:
             pearson_df(data, data.loc[1])
         assert 'data.index must be unique' in str(ex.value)
 
+    def test_subset_not_in_data(self, data):
+        'When subset has rows not in data, raise ValueError'
+        subset = pd.DataFrame(np.zeros((1, 3)), index=['missing'])
+        with pytest.raises(ValueError) as ex:
+            pearson_df(data, subset)
+        assert 'subset.index must be a subset of data.index' in str(ex.value)
+
     def test_subset_everything(self, data):
         'When subset is everything'
         self.assert_pearson(data, list(range(len(data))))
@@ -497,6 +584,28 @@ class TestPearsonDf:
         actual = pearson_df(pd.DataFrame(), pd.DataFrame())
         assert_df_equals(actual, pd.DataFrame())
 
+def test_pearson_constant_row():
+    'Correlations with a constant row are NaN, even when its mean is inexact'
+    data = np.array([[0.1] * 7, [1, 2, 3, 4, 5, 6, 7]])
+    with warnings.catch_warnings():
+        # Without dividing by zero
+        warnings.simplefilter('error')
+        actual = pearson(data, [0, 1])
+    np.testing.assert_allclose(actual, [[np.nan, np.nan], [np.nan, 1]])
+
+def test_pearson_mask_like_arange():
+    'A boolean mask which equals arange element-wise selects rows by mask'
+    data = np.array([[1., 2, 3], [3, 1, 2]])
+    actual = pearson(data, [False, True])
+    np.testing.assert_allclose(actual, np.corrcoef(data)[:, [1]])
+
+def test_pearson_float32():
+    'Calculate in float32 when asked to, within float32 precision'
+    data = np.random.rand(10, 20)
+    actual = pearson(data, [1, 2], dtype=np.float32)
+    assert actual.dtype == np.float32
+    np.testing.assert_allclose(actual, pearson(data, [1, 2]), rtol=1e-5, atol=1e-6)
+
 def test_pearson_df():
     data = pd.DataFrame([[1, 2, 3], [3, 2, 1], [1, 2, 1]], index=['a', 'b', 'c'], dtype=float)
     indices = ['b', 'a']
@@ -17,19 +17,24 @@
 
 from textwrap import dedent
 import csv
-import io
 import logging
 
 from varbio._util import open_text, UserError, join_lines
 
 
-def parse_csv(path):
+def parse_csv(path, dialect=None, encoding=None):
     '''
     Robustly parse csv
 
     Parameters
     ----------
     path : ~pathlib.Path
+    dialect : csv.Dialect or str or None
+        Dialect as accepted by `csv.reader`. If None, it is autodetected.
+        Pass it when known to skip detection, e.g. when parsing many files
+        of the same format.
+    encoding : str or None
+        Encoding of the file. If None, it is autodetected. See `open_text`.
 
     Yields
     ------
@@ -38,13 +43,12 @@ def parse_csv(path):
     '''
     # Remove empty lines up front, otherwise the sniffer fails to detect
     # the right/any delimiter sometimes.
-    with open_text(path) as f:
+    with open_text(path, encoding) as f:
         line_numbers = []
         lines = []
         for line_number, line in _read_non_empty_lines(f):
             line_numbers.append(line_number)
             lines.append(line)
-        text = '\n'.join(lines)
 
     if not lines:
         raise UserError(join_lines(
@@ -54,30 +58,35 @@ def parse_csv(path):
             '''
         ))
 
-    dialect = _detect_dialect(text, lines)
-    logging.info(dedent(f'''\
-        Detected csv dialect of {path}:
-        delimiter {dialect.delimiter!r}
-        quotechar {dialect.quotechar!r}
-        doublequote {dialect.doublequote!r}
-        quoting {dialect.quoting!r}
-        escapechar {dialect.escapechar!r}'''
-    ))
+    if dialect is None:
+        dialect = _detect_dialect(lines)
+        logging.info(dedent(f'''\
+            Detected csv dialect of {path}:
+            delimiter {dialect.delimiter!r}
+            quotechar {dialect.quotechar!r}
+            doublequote {dialect.doublequote!r}
+            quoting {dialect.quoting!r}
+            escapechar {dialect.escapechar!r}'''
+        ))
 
-    yield from _parse(text, lines, line_numbers, dialect)
+    yield from _parse(lines, line_numbers, dialect)
 
-def _detect_dialect(text, lines):
+def _detect_dialect(lines):
     # Possible delimiters have to be specified, otherwise it can pick any char
     # as delimiter, e.g. 'e'.
     delimiters = ';,\t| '
     sniffer = csv.Sniffer()
+    # The sniffer's regexes get slow on large input and the first lines
+    # suffice to tell the dialect
+    sample_size = 20
     try:
-        return sniffer.sniff(text, delimiters)
+        return sniffer.sniff('\n'.join(lines[:sample_size]), delimiters)
     except csv.Error as ex:
         logging.warning(join_lines(
             f'''
-            Failed to autodetect csv format based on whole file, retrying with
-            just the first 2 (non-empty) lines. Autodetect error: {ex}
+            Failed to autodetect csv format based on the first {sample_size}
+            (non-empty) lines, retrying with just the first 2 lines.
+            Autodetect error: {ex}
             '''
         ))
         try:
@@ -93,7 +102,7 @@ def _detect_dialect(text, lines):
             )
             raise UserError(msg) from ex
 
-def _parse(text, lines, line_numbers, dialect):
+def _parse(lines, line_numbers, dialect):
     def get_line():
         # line_num is not the same as using enumerate if a csv row can span
         # multiple lines; which isn't the case with our inputs though, but no
@@ -103,8 +112,10 @@ def _parse(text, lines, line_numbers, dialect):
     def get_line_number():
         return line_numbers[reader.line_num - 1]
 
-    f = io.StringIO(text)
-    reader = csv.reader(f, dialect)
+    # The lines are the file content already, no need to join them into a
+    # single str and read that back through a StringIO. Their line endings
+    # are restored though, else quoted values spanning lines lose theirs.
+    reader = csv.reader((line + '\n' for line in lines), dialect)
     col_count = None
     for row in reader:
         if not col_count:
@@ -116,19 +127,22 @@ def _parse(text, lines, line_numbers, dialect):
                 f'expected {col_count}. Line:\n{get_line()}'
             )
 
-        row = [value.strip() for value in row]
+        row = list(map(str.strip, row))
 
-        for col, value in enumerate(row, start=1):
-            if not value:
-                raise UserError(
-                    f'Line {get_line_number()}, column {col} (1-based) is empty (or '
-                    f'is whitespace); it must have a value. Line:\n{get_line()}'
-                )
+        # Membership test instead of checking each value in a Python loop
+        if '' in row:
+            col = row.index('') + 1
+            raise UserError(
+                f'Line {get_line_number()}, column {col} (1-based) is empty (or '
+                f'is whitespace); it must have a value. Line:\n{get_line()}'
+            )
 
         yield row
 
 def _read_non_empty_lines(f):
-    for line_number, line in enumerate(f.readlines(), start=1):
-        if not line.strip():
+    # Lines read from a file are never '', so isspace suffices to detect
+    # blank lines without allocating a stripped copy
+    for line_number, line in enumerate(f, start=1):
+        if line.isspace():
             continue
         yield line_number, line.rstrip('\n')
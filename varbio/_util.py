@@ -21,9 +21,27 @@ other way around
 '''
 
 from contextlib import contextmanager
+import codecs
+
 import chardet
 
 
+# BOMs which identify the encoding without needing to detect it. UTF-32 goes
+# first as its LE BOM starts with the UTF-16 LE BOM. The codecs consume the
+# BOM when decoding.
+_BOM_ENCODINGS = (
+    ((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE), 'utf-32'),
+    ((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE), 'utf-16'),
+    ((codecs.BOM_UTF8,), 'utf-8-sig'),
+)
+
+# Max number of bytes chardet gets to see. Encoding rarely changes mid-file and
+# chardet is slow, so this keeps detection cheap on large files. The sample is
+# fed in chunks so detection can stop as soon as chardet is confident. Checking
+# for utf-8 reads the rest of the file in chunks of the sample size.
+_CHARDET_SAMPLE_SIZE = 64 * 1024
+_CHARDET_CHUNK_SIZE = 8 * 1024
+
 class UserError(Exception):
     '''
     Error caused by user, e.g. invalid input
@@ -36,26 +54,85 @@ class UserError(Exception):
     '''
 
 @contextmanager
-def open_text(path):
+def open_text(path, encoding=None):
     '''
     Robustly open text file
 
-    Autodetect encoding. Python's universal newlines takes care of
-    strange/mixed line endings.
+    Autodetect encoding unless given. Python's universal newlines takes care
+    of strange/mixed line endings.
 
     Parameters
     ----------
     path : ~pathlib.Path
+    encoding : str or None
+        Encoding of the file. If None, it is autodetected. Unless the file
+        turns out not to be utf-8 early on, this reads the whole file an extra
+        time, in chunks.
 
     Returns
     -------
     file
         File object of the opened text file
     '''
-    with path.open('rb') as f:
-        encoding = chardet.detect(f.read())['encoding']
+    if encoding is None:
+        with path.open('rb') as f:
+            encoding = _detect_encoding(f)
     with path.open(encoding=encoding) as f:
         yield f
 
+def _detect_encoding(f):
+    sample = f.read(_CHARDET_SAMPLE_SIZE)
+    for boms, encoding in _BOM_ENCODINGS:
+        if sample.startswith(boms):
+            return encoding
+
+    # Most input is valid utf-8 (or ascii, which is a subset), which is far
+    # cheaper to verify than to have chardet guess it
+    invalid_chunk = _find_non_utf8(sample, f)
+    if invalid_chunk is None:
+        return 'utf-8'
+
+    # Give chardet the chunk which is not utf-8 first, the sample is all
+    # ascii when the other characters only appear further on. The sample
+    # still adds context.
+    raw = invalid_chunk
+    if invalid_chunk is not sample:
+        raw += sample
+    detector = chardet.UniversalDetector()
+    for start in range(0, len(raw), _CHARDET_CHUNK_SIZE):
+        detector.feed(raw[start:start + _CHARDET_CHUNK_SIZE])
+        if detector.done:
+            break
+
+    # chardet gives None when it cannot tell, which open would take as the
+    # locale's encoding
+    return detector.close()['encoding'] or 'utf-8'
+
+def _find_non_utf8(sample, f):
+    # Get the first chunk of sample and the rest of f which is not valid
+    # utf-8, or None if all is valid. The incremental decoder handles
+    # characters split across chunks; the returned chunk includes the start
+    # of such a character.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunk = sample
+    while chunk:
+        # Bytes of an unfinished character at the end of the previous chunk
+        pending = decoder.getstate()[0]
+        # isascii does not allocate a decoded copy, but an ascii chunk is
+        # only valid when no character is left unfinished before it
+        if pending or not chunk.isascii():
+            try:
+                decoder.decode(chunk)
+            except UnicodeDecodeError:
+                return pending + chunk if pending else chunk
+        last_chunk = chunk
+        chunk = f.read(_CHARDET_SAMPLE_SIZE)
+    try:
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        # Ends in an unfinished character
+        return last_chunk
+    return None
+
 def join_lines(text):
     return ' '.join(map(str.strip, text.splitlines())).strip()
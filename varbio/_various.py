@@ -15,13 +15,15 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with varbio.  If not, see <http://www.gnu.org/licenses/>.
 
+from copy import deepcopy
+from functools import lru_cache
+from itertools import chain, filterfalse, islice
 from numbers import Number
 from textwrap import dedent
 import logging
 import re
 
 import attr
-import humanize
 import numpy as np
 import pandas as pd
 import yaml
@@ -30,6 +32,16 @@ from varbio import __version__
 from varbio._util import open_text, UserError, join_lines
 
 
+# Separates bait names in a baits file
+_BAIT_SEPARATOR = re.compile(r'[\s,;]+')
+
+# Checking type() against these first is several times faster than an
+# isinstance check against the Number ABC, and covers nearly all values
+_COMMON_NUMBER_TYPES = (float, int)
+
+def _is_number(value):
+    return type(value) in _COMMON_NUMBER_TYPES or isinstance(value, Number)
+
 @attr.s(slots=True, repr=False, frozen=True)
 class ExpressionMatrix:
 
@@ -128,7 +140,7 @@ class ExpressionMatrix:
                 _raise(
                     'The {} row is not a list. Perhaps you forgot to wrap '
                     'the row in []?\n\nGiven row: {!r}'
-                    .format(humanize.ordinal(i), row)
+                    .format(_ordinal(i), row)
                 )
 
         # Column count should be consistent across rows
@@ -139,33 +151,33 @@ class ExpressionMatrix:
                 _raise(
                     'The {} row has {} columns than previous rows. All rows '
                     'should have the same length.\n\nGiven row: {!r}'
-                    .format(humanize.ordinal(i), difference, row)
+                    .format(_ordinal(i), difference, row)
                 )
 
-        # dtype=object to preserve the type, else the whole lot can become str
-        # for example
-        data = np.array(data, dtype=object)
-        cls._warn_if_unexpected_type(data)
+        # Split into header, row names and values right away rather than via
+        # an intermediate dtype=object array, the values can then be
+        # converted to float in a single pass
+        columns = data[0][1:]
+        rows = [row[0] for row in data[1:]]
+        values = [row[1:] for row in data[1:]]
+        cls._warn_if_unexpected_type(columns, rows, values)
 
-        return cls._from_array(matrix['name'], data)
+        return cls._from_parts(matrix['name'], data[0][0], rows, columns, values)
 
     @classmethod
-    def _warn_if_unexpected_type(cls, data):
-        columns = data[0, 1:]
-        rows = data[1:, 0]
-        values = data[1:, 1:]
+    def _warn_if_unexpected_type(cls, columns, rows, values):
         should_warn = False
 
         # Warn if all row or column names are numbers. This guards against an input
         # like [[1, 2], [3, 4]]; i.e. user forgot to add a header or row names.
-        if all(isinstance(row, Number) for row in rows):
+        if all(map(_is_number, rows)):
             should_warn = True
             logging.warning(
                 'All row names are numbers, perhaps you forgot to add the row '
                 'names? If this is intended, consider wrapping them in '
                 'quotes (\'") to avoid this warning.'
             )
-        if all(isinstance(column, Number) for column in columns):
+        if all(map(_is_number, columns)):
             should_warn = True
             logging.warning(
                 'All column names are numbers, perhaps you forgot to add the header row? '
@@ -175,11 +187,14 @@ class ExpressionMatrix:
 
         # We also warn for values as this is also not something you'd tend to
         # normally do
-        odd_values = [value for value in values.ravel() if not isinstance(value, Number)]
-        if odd_values:
+        # Only the first few are shown, so count the rest rather than
+        # collecting all of them
+        odd_values = filterfalse(_is_number, chain.from_iterable(values))
+        shown_values = list(islice(odd_values, 10))
+        if shown_values:
             should_warn = True
-            odd_count = len(odd_values)
-            odd_values = list(map(repr, odd_values[:10]))
+            odd_count = len(shown_values) + sum(1 for _ in odd_values)
+            odd_values = list(map(repr, shown_values))
             if odd_count > 10:
                 odd_values.append('...')
             odd_values = ', '.join(odd_values)
@@ -197,28 +212,53 @@ class ExpressionMatrix:
     @classmethod
     def from_csv(cls, name, data):
         'Construct from data parsed with parse_csv'
-        data = np.array(list(data), dtype=object)
-        return cls._from_array(name, data)
+        # Consume the rows as they are parsed rather than collecting them in a
+        # dtype=object array first
+        data = iter(data)
+        header = next(data)
+        rows = []
+        values = []
+        for row in data:
+            rows.append(row[0])
+            values.append(row[1:])
+        return cls._from_parts(name, header[0], rows, header[1:], values)
 
     @classmethod
     def _from_array(cls, name, data):
-        # Convert values to the correct type and create a df from them
-        columns = data[0, 1:]
-        rows = data[1:, 0]
-        values = data[1:, 1:]
-        index = pd.Index(rows.astype(str), name=str(data[0, 0]))
-        columns = columns.astype(str)
+        return cls._from_parts(
+            name, data[0, 0], data[1:, 0], data[0, 1:], data[1:, 1:]
+        )
+
+    @classmethod
+    def _from_parts(cls, name, index_name, rows, columns, values):
+        # Row and column names are always treated as str, values as float
+        index = pd.Index([str(row) for row in rows], name=str(index_name))
+        columns = [str(column) for column in columns]
         try:
-            df = pd.DataFrame(values, index=index, columns=columns, dtype=float)
-        except ValueError as ex:
-            if 'convert string to float' in str(ex):
-                msg = f'Invalid float value: {ex.__cause__.args[0]}'
-                raise UserError(msg) from ex
+            values = np.array(values, dtype=float)
+        except (ValueError, TypeError) as ex:
+            raise UserError(f'Invalid float value: {ex}') from ex
+        if not len(index):
+            # Without rows, np.array gives shape (0,) instead of (0, n)
+            values = values.reshape(0, len(columns))
+        if values.shape != (len(index), len(columns)):
+            # A value was a list, e.g. [] yields shape (1, 1, 0)
+            raise UserError('Invalid float value: values must not be lists')
+        df = pd.DataFrame(values, index=index, columns=columns)
         try:
             return cls(name=name, data=df)
         except ValueError as ex:
             raise UserError(ex.args[0]) from ex
 
+def _ordinal(number):
+    # Same output as humanize.ordinal, without importing humanize, e.g. 1st,
+    # 2nd, 11th, 21st
+    if 10 <= number % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return f'{number}{suffix}'
+
 def parse_yaml(path):
     '''
     Robustly parse yaml
@@ -231,12 +271,28 @@ def parse_yaml(path):
     -------
     dict or list
         Parsed YAML as returned by `yaml.load`.
+
+    Notes
+    -----
+    Results are cached by absolute path, modification time and size, so
+    parsing the same unchanged file again is cheap. Each call returns a copy
+    which the caller is free to modify.
     '''
+    # Resolve so a relative path does not hit the cache entry of the same
+    # relative path from another working directory
+    path = path.resolve()
+    stat = path.stat()
+    return deepcopy(_parse_yaml(path, stat.st_mtime_ns, stat.st_size))
+
+@lru_cache(maxsize=100)
+def _parse_yaml(path, mtime_ns, size):  # pylint: disable=unused-argument
+    # mtime_ns and size are only part of the cache key
     with open_text(path) as f:
-        # C loaders are faster than regular loaders but require libyaml,
-        # performance is not an issue in our case so we rather ditch the
-        # dependency. SafeLoader disables insecure features which we don't need,
-        # e.g. arbitrary code execution if I recall correctly; more generally it
+        # C loaders are faster than regular loaders but require libyaml and
+        # accept input the regular loader rejects, e.g. tab indentation. We
+        # rather keep the regular loader and avoid reparsing with the cache.
+        # SafeLoader disables insecure features which we don't need, e.g.
+        # arbitrary code execution if I recall correctly; more generally it
         # reduces the attack surface from parsing untrusted inputs.
         try:
             return yaml.load(f, yaml.SafeLoader)
@@ -261,7 +317,7 @@ def parse_baits(path, min_baits):
         # input for that
         baits = [
             bait
-            for bait in re.split(r'[\s,;]+', f.read())
+            for bait in _BAIT_SEPARATOR.split(f.read())
             if bait
         ]
 
@@ -272,7 +328,7 @@ def parse_baits(path, min_baits):
 
         return baits
 
-def pearson(data, indices):
+def pearson(data, indices, dtype=np.float64):
     '''
     Get Pearson's r of each row in a 2D array compared to a subset thereof.
 
@@ -283,6 +339,10 @@ def pearson(data, indices):
     indices
         Indices to derive the subset ``data[indices]`` to compare against. You
         may use any form of numpy indexing.
+    dtype : numpy.dtype
+        Float type of the matrix product and the result. ``numpy.float32``
+        halves the memory of the result and speeds up the matrix product, at
+        the cost of precision. Rows are always centered in float64.
 
     Returns
     -------
@@ -293,9 +353,9 @@ def pearson(data, indices):
 
     Notes
     -----
-    The current implementation is a vectorised form of ``gsl_stats_correlation``
-    from the GNU Scientific Library. Unlike GSL's implementation,
-    correlations are clipped to ``[-1, 1]``.
+    The current implementation centers each row on its mean and computes the
+    sums of cross products of all pairs as a single matrix product.
+    Correlations are clipped to ``[-1, 1]`` to hide rounding errors.
 
     Pearson's r is also, perhaps more commonly, known as the product-moment
     correlation coefficient.
@@ -308,28 +368,53 @@ def pearson(data, indices):
     #
     # pylint: disable=len-as-condition
     if not data.size or not len(indices):
-        return np.empty((data.shape[0], len(indices)))
-
-    matrix = data
-    mean = matrix[:, 0].copy()
-    delta = np.empty(matrix.shape[0])
-    sum_sq = np.zeros(matrix.shape[0])  # sum of squares
-    sum_cross = np.zeros((matrix.shape[0], len(indices)))
-
-    for i in range(1, matrix.shape[1]):
-        ratio = i / (i+1)
-        delta = matrix[:, i] - mean
-        sum_sq += (delta**2) * ratio
-        sum_cross += np.outer(delta, delta[indices]) * ratio
-        mean += delta / (i+1)
-
-    sum_sq = np.sqrt(sum_sq)
-    with np.errstate(divide='ignore', invalid='ignore'):  # divide by zero, it happens
-        correlations = sum_cross / np.outer(sum_sq, sum_sq[indices])
+        return np.empty((data.shape[0], len(indices)), dtype=dtype)
+
+    # Center each row, then all covariances are a single matrix product which
+    # numpy hands off to BLAS. Shifting by the first column beforehand makes
+    # constant rows exactly 0 (instead of off by a rounding error of the mean)
+    # and improves accuracy when values are large compared to their spread.
+    #
+    # Centering loses the most precision, so it's done in float64 regardless
+    # of dtype; only the matrix product, the bulk of the work, uses dtype.
+    #
+    # The result is row-major so the row reductions below stream through
+    # memory; DataFrame.values tends to be column-major.
+    centered = np.subtract(data, data[:, [0]], dtype=np.float64, order='C')
+    centered -= centered.mean(axis=1, keepdims=True)
+    norms = np.sqrt(np.einsum('ij,ij->i', centered, centered)).astype(dtype)
+    centered = centered.astype(dtype, copy=False)
+
+    # numpy computes a @ a.T as a symmetric product (BLAS syrk), which is
+    # faster, but only when given the same array, not a copy via indices.
+    # Only integer indices can select all rows in order; a boolean mask such
+    # as [False, True] can equal arange while selecting just one row.
+    indices_array = np.asarray(indices)
+    if (
+        indices_array.dtype.kind in 'iu'
+        and np.array_equal(indices_array, np.arange(len(data)))
+    ):
+        subset = centered
+    else:
+        subset = centered[indices]
+    correlations = centered @ subset.T
+
+    # Divide by the norms afterwards rather than normalising the rows up
+    # front, so uncorrelated rows come out as exactly 0. In place, to not
+    # allocate another array the size of the result.
+    #
+    # Constant rows have a norm of 0 and their correlation is undefined. Mark
+    # those NaN explicitly rather than dividing 0 by 0.
+    constant = norms == 0
+    norms[constant] = 1
+    correlations /= norms[:, np.newaxis]
+    correlations /= norms[indices]
+    correlations[constant] = np.nan
+    correlations[:, constant[indices]] = np.nan
     np.clip(correlations, -1, 1, correlations)
     return correlations
 
-def pearson_df(data, subset):
+def pearson_df(data, subset, dtype=np.float64):
     '''
     Get Pearson correlation of each row in a DataFrame compared to a subset
     thereof.
@@ -341,6 +426,8 @@ def pearson_df(data, subset):
     subset
         Subset of ``data`` to compare against. ``subset.index`` must be a subset
         of ``data.index``.
+    dtype : numpy.dtype
+        Float type to calculate in, see `pearson`.
 
     Returns
     -------
@@ -352,8 +439,14 @@ def pearson_df(data, subset):
     '''
     if not data.index.is_unique:
         raise ValueError('data.index must be unique')
-    correlations = pearson(data.values, subset.index.map(data.index.get_loc))
-    correlations = pd.DataFrame(correlations, index=data.index, columns=subset.index)
+    indices = data.index.get_indexer(subset.index)
+    if (indices == -1).any():
+        raise ValueError('subset.index must be a subset of data.index')
+    correlations = pearson(data.values, indices, dtype=dtype)
+    correlations = pd.DataFrame(
+        correlations, index=data.index, columns=subset.index,
+        copy=False,  # pearson returns a fresh array, no need to copy it again
+    )
     return correlations
 
 def init_logging(program, version, log_file):